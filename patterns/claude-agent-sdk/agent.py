@@ -15,52 +15,121 @@ from claude_agent_sdk import (
     ProcessError,
 )
 from bedrock_agentcore.runtime import BedrockAgentCoreApp, RequestContext
-from agents.subagents import get_subagent_definitions
-from utils.auth import extract_user_id_from_context, get_gateway_access_token
+from agents.subagents import SESSION_MANAGEMENT_RULES, get_subagent_definitions
+from utils.auth import extract_user_id_from_context, get_gateway_access_token_with_expiry
 from utils.ssm import get_ssm_parameter
+from collections.abc import AsyncIterator, Callable, Iterator
+from dataclasses import dataclass
+from typing import Any, Generic, TypeVar
+import asyncio
+import functools
 import logging
-import json
 import os
+import time
+import orjson
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = BedrockAgentCoreApp()
 
+# Refresh the Gateway token a minute before Cognito's reported expiry so it
+# never expires mid-request. Holds (token, monotonic expiry time).
+_GATEWAY_TOKEN_REFRESH_MARGIN_SECONDS = 60
+_gateway_token: tuple[str, float] = ("", 0.0)
 
-@app.entrypoint
-async def main(payload, context: RequestContext):
-    """
-    Entrypoint for the Claude Agent SDK pattern.
-    Uses ClaudeSDKClient for streaming with Code Interpreter and Gateway tools.
-    User identity is extracted securely from the validated JWT token.
-    """
-    prompt = payload["prompt"]
-    runtime_session_id = payload.get("runtimeSessionId", "")
-    code_int_session_id = payload.get("code_int_session_id", "")
-    claude_session_id = payload.get("claude_session_id")
+_SYSTEM_PROMPT = f"""You are an AI assistant that helps users with code execution and analysis tasks.
 
-    # Extract user ID securely from validated JWT token
-    user_id = extract_user_id_from_context(context)
-    logger.info("[AGENT] User: %s, Session: %s", user_id, runtime_session_id)
+CRITICAL RULES:
+1. You MUST use mcp__codeint__execute_code for ALL Python code execution tasks.
+2. You can use mcp__codeint__execute_command to execute bash commands.
+3. Use gateway tools (mcp__gateway__*) for accessing tools provided via the Gateway.
+4. Use the tools without asking for permission.
+
+{SESSION_MANAGEMENT_RULES}
+
+SUBAGENT DELEGATION:
+You have specialized subagents available via the Task tool:
+- code-analyst: For analyzing code output, debugging errors, explaining results. Has Code Interpreter and Gateway tools.
+When delegating, include all relevant context in the Task prompt.
+
+Code Interpreter also provides write_files and read_files.
+
+Your response should:
+1. Show the results
+2. Provide a brief explanation
+"""
+
+# Code Interpreter tools are always available; Gateway and Task are added per build
+_STATIC_ALLOWED_TOOLS = (
+    "mcp__codeint__execute_code",
+    "mcp__codeint__execute_command",
+    "mcp__codeint__write_files",
+    "mcp__codeint__read_files",
+)
+
+# Subagents inherit MCP servers from the parent options, so definitions are static
+_SUBAGENTS = get_subagent_definitions({})
+
+
+@functools.lru_cache(maxsize=1)
+def _get_gateway_url() -> str:
+    """Fetch the Gateway URL from SSM once per container."""
+    stack_name = os.environ["STACK_NAME"]
+    return get_ssm_parameter(f"/{stack_name}/gateway_url")
 
-    # Get Gateway URL and access token
-    stack_name = os.environ.get("STACK_NAME")
-    gateway_url = get_ssm_parameter(f"/{stack_name}/gateway_url") if stack_name else None
-    access_token = get_gateway_access_token() if gateway_url else None
 
-    agent_responses = []
+def _cached_gateway_access_token() -> str | None:
+    """Return the cached Gateway access token, or None if it is due for refresh."""
+    token, expires_at = _gateway_token
+    refresh_at = expires_at - _GATEWAY_TOKEN_REFRESH_MARGIN_SECONDS
+    if not token or time.monotonic() > refresh_at:
+        return None
+    return token
 
-    # Build MCP servers config
+
+def _get_gateway_access_token() -> str:
+    """Return a cached Gateway access token, refreshing it shortly before expiry."""
+    global _gateway_token
+    token = _cached_gateway_access_token()
+    if token is None:
+        token, expires_in = get_gateway_access_token_with_expiry()
+        _gateway_token = (token, time.monotonic() + expires_in)
+    return token
+
+
+async def _get_gateway_config() -> tuple[str | None, str | None]:
+    """Fetch the Gateway URL and access token, off the event loop on a cache miss.
+
+    Warm containers answer from the caches inline. Values that miss are blocking
+    AWS calls that only depend on STACK_NAME, so they run in threads and
+    overlap when both are cold.
+    """
+    if not os.environ.get("STACK_NAME"):
+        return None, None
+    url_cached = _get_gateway_url.cache_info().currsize > 0
+    access_token = _cached_gateway_access_token()
+    if not url_cached and access_token is None:
+        gateway_url, access_token = await asyncio.gather(
+            asyncio.to_thread(_get_gateway_url),
+            asyncio.to_thread(_get_gateway_access_token),
+        )
+        return gateway_url, access_token
+    if url_cached:
+        gateway_url = _get_gateway_url()
+    else:
+        gateway_url = await asyncio.to_thread(_get_gateway_url)
+    if access_token is None:
+        access_token = await asyncio.to_thread(_get_gateway_access_token)
+    return gateway_url, access_token
+
+
+@functools.lru_cache(maxsize=1)
+def _get_mcp_servers(gateway_url: str | None, access_token: str | None) -> dict:
+    """Build the MCP servers config, reused until the Gateway token changes."""
     mcp_servers = {
         "codeint": code_int_mcp_server,
     }
-    allowed_tools = [
-        "mcp__codeint__execute_code",
-        "mcp__codeint__execute_command",
-        "mcp__codeint__write_files",
-        "mcp__codeint__read_files",
-    ]
 
     # Add Gateway MCP server if available
     if gateway_url and access_token:
@@ -69,98 +138,400 @@ async def main(payload, context: RequestContext):
             "url": gateway_url,
             "headers": {"Authorization": f"Bearer {access_token}"},
         }
-        allowed_tools.append("mcp__gateway__*")
         logger.info("Gateway MCP server configured: %s", gateway_url)
 
-    # Add Task tool for subagent spawning
-    allowed_tools.append("Task")
-
-    # Build subagent definitions
-    subagents = get_subagent_definitions(mcp_servers)
-
-    def _build_options(resume_id: str | None) -> ClaudeAgentOptions:
-        """Build ClaudeAgentOptions, optionally with a resume session ID."""
-        return ClaudeAgentOptions(
-            mcp_servers=mcp_servers,
-            model="us.anthropic.claude-opus-4-6-v1",
-            allowed_tools=allowed_tools,
-            agents=subagents,
-            resume=resume_id,
-            thinking={"type": "adaptive"},
-            cli_path="/usr/bin/claude",
-            stderr=lambda line: logger.error("claude-code stderr: %s", line),
-            system_prompt=f"""You are an AI assistant that helps users with code execution and analysis tasks.
+    return mcp_servers
 
-CRITICAL RULES:
-1. You MUST use mcp__codeint__execute_code for ALL Python code execution tasks.
-2. You can use mcp__codeint__execute_command to execute bash commands.
-3. Use gateway tools (mcp__gateway__*) for accessing tools provided via the Gateway.
-4. Use the tools without asking for permission.
-5. CODE INTERPRETER SESSION: For the first Code Interpreter call, pass an empty string "" for code_int_session_id. The tool will return a valid session ID in its response. Use that EXACT returned session ID for all subsequent Code Interpreter calls in this conversation. NEVER make up or generate your own session IDs.
 
-SUBAGENT DELEGATION:
-You have specialized subagents available via the Task tool:
-- code-analyst: For analyzing code output, debugging errors, explaining results. Has Code Interpreter and Gateway tools.
-When delegating, include all relevant context in the Task prompt.
+@functools.lru_cache(maxsize=128)
+def _build_options(
+    resume_id: str | None, gateway_url: str | None, access_token: str | None
+) -> ClaudeAgentOptions:
+    """Build ClaudeAgentOptions, optionally with a resume session ID.
 
-Available tool categories:
-- Code Interpreter: execute_code, execute_command, write_files, read_files
-- Gateway: Tools provided via the AgentCore Gateway (mcp__gateway__*)
+    Cached on all arguments so repeat sessions in the same container reuse the
+    options, and a refreshed access token naturally produces a new entry.
+    """
+    # Gateway tools only when the Gateway MCP server is configured; Task enables
+    # subagent spawning
+    gateway_tools = ("mcp__gateway__*",) if gateway_url and access_token else ()
+    allowed_tools = _STATIC_ALLOWED_TOOLS + gateway_tools + ("Task",)
 
-Your response should:
-1. Show the results
-2. Provide a brief explanation
-""",
-        )
+    return ClaudeAgentOptions(
+        mcp_servers=_get_mcp_servers(gateway_url, access_token),
+        model="us.anthropic.claude-opus-4-6-v1",
+        allowed_tools=allowed_tools,
+        agents=_SUBAGENTS,
+        resume=resume_id,
+        thinking={"type": "adaptive"},
+        cli_path="/usr/bin/claude",
+        stderr=lambda line: logger.error("claude-code stderr: %s", line),
+        system_prompt=_SYSTEM_PROMPT,
+    )
+
+
+@dataclass(slots=True)
+class _StreamState:
+    """Per-request state shared by the message handlers."""
+
+    # Captured from tool results but not currently read or sent to the client
+    code_int_session_id: str = ""
+    code_int_session_captured: bool = False
+    claude_session_id: str = ""
+
+
+def _handle_tool_use_block(block: ToolUseBlock, state: _StreamState) -> dict | None:
+    logger.info("TOOL USE: %s", block.name)
+    tool_id = getattr(block, "id", None) or id(block)
+    return {
+        "current_tool_use": {
+            "name": block.name,
+            "input": block.input,
+            "toolUseId": f"tool-{tool_id}",
+        }
+    }
+
+
+def _handle_text_block(block: TextBlock, state: _StreamState) -> dict | None:
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Agent response: %s", block.text)
+    return {"data": block.text}
+
+
+def _handle_tool_result_block(block: ToolResultBlock, state: _StreamState) -> dict | None:
+    # The session ID only needs capturing once per request
+    if state.code_int_session_captured:
+        return None
+    first = block.content[0] if block.content else None
+    if not isinstance(first, dict):
+        return None
+    text_content = first.get("text", "")
+    # Cheap substring check so large tool outputs without a session ID
+    # are never parsed
+    if "code_int_session_id" not in text_content:
+        return None
+    # Only a JSON object can carry the session ID; skip anything else
+    # rather than paying for a failed parse
+    if not text_content.lstrip().startswith("{"):
+        return None
+    try:
+        result_data = orjson.loads(text_content)
+    except orjson.JSONDecodeError:
+        return None
+    extracted = result_data.get("code_int_session_id", "")
+    if extracted:
+        state.code_int_session_id = extracted
+        state.code_int_session_captured = True
+    return None
+
+
+_BlockHandler = Callable[[Any, _StreamState], dict | None]
+_MessageHandler = Callable[[Any, _StreamState], Iterator[dict]]
+
+_H = TypeVar("_H")
+_NOT_CACHED = object()
+
+
+class _HandlerTable(Generic[_H]):
+    """Exact-type handler lookup that resolves subclasses once.
+
+    Known SDK types hit the table directly. Any other type is matched against
+    its base classes on first sight and the result (possibly None) is memoized
+    in a separate cache, so later lookups are a single dict probe either way.
+    """
+
+    def __init__(self, handlers: dict[type, _H]):
+        self.handlers = handlers
+        self._resolved: dict[type, _H | None] = dict(handlers)
+
+    def get(self, cls: type) -> _H | None:
+        handler = self._resolved.get(cls, _NOT_CACHED)
+        if handler is _NOT_CACHED:
+            handler = next(
+                (self.handlers[base] for base in cls.__mro__[1:] if base in self.handlers),
+                None,
+            )
+            self._resolved[cls] = handler
+        return handler
+
+
+# Content block handlers keyed on exact block type; unlisted types are ignored
+_ASSISTANT_BLOCK_HANDLERS: _HandlerTable[_BlockHandler] = _HandlerTable({
+    ToolUseBlock: _handle_tool_use_block,
+    TextBlock: _handle_text_block,
+})
+_USER_BLOCK_HANDLERS: _HandlerTable[_BlockHandler] = _HandlerTable({
+    ToolResultBlock: _handle_tool_result_block,
+})
+
+
+def _dispatch_blocks(
+    content: list, handlers: _HandlerTable[_BlockHandler], state: _StreamState
+) -> Iterator[dict]:
+    """Run each content block through its handler and yield resulting events."""
+    for block in content:
+        handler = handlers.get(type(block))
+        if handler:
+            event = handler(block, state)
+            if event is not None:
+                yield event
+
+
+def _handle_system_message(msg: SystemMessage, state: _StreamState) -> Iterator[dict]:
+    if msg.subtype == "init":
+        logger.info("Claude session init: %s", msg.data.get("session_id"))
+    return iter(())
+
+
+def _handle_assistant_message(msg: AssistantMessage, state: _StreamState) -> Iterator[dict]:
+    return _dispatch_blocks(msg.content, _ASSISTANT_BLOCK_HANDLERS, state)
+
+
+def _handle_user_message(msg: UserMessage, state: _StreamState) -> Iterator[dict]:
+    return _dispatch_blocks(msg.content, _USER_BLOCK_HANDLERS, state)
+
+
+def _handle_result_message(msg: ResultMessage, state: _StreamState) -> Iterator[dict]:
+    logger.info("ResultMessage received, session_id=%s", msg.session_id)
+    state.claude_session_id = msg.session_id
+    yield {"claude_session_id": msg.session_id}
+
+
+# Message handlers keyed on exact message type, replacing an isinstance chain
+# in the per-message streaming loop
+_MSG_HANDLERS: _HandlerTable[_MessageHandler] = _HandlerTable({
+    SystemMessage: _handle_system_message,
+    AssistantMessage: _handle_assistant_message,
+    UserMessage: _handle_user_message,
+    ResultMessage: _handle_result_message,
+})
+
+
+# Pooled clients are keyed on (claude_session_id, gateway_url, access_token) so a
+# follow-up turn reuses the live claude-code process that already holds its session.
+# Only turns that arrived with a claude_session_id are parked.
+_CLIENT_POOL_MAX_SIZE = 8
+_CLIENT_IDLE_TIMEOUT_SECONDS = 300
+_CLIENT_POOL_CLEAN_INTERVAL_SECONDS = 60
+_CLIENT_POOL: dict[tuple, "_PooledClient"] = {}
+_client_pool_lock = asyncio.Lock()
+_client_pool_janitor: asyncio.Task | None = None
+_END_OF_RESPONSE = object()
+# Bound on SDK messages a pooled client buffers ahead of the response writer
+_RESPONSE_BUFFER_SIZE = 32
+# Waiting text is merged into one event up to roughly this many characters
+_TEXT_COALESCE_CHARS = 256
+
+
+class _PooledClient:
+    """A ClaudeSDKClient that can outlive the request that created it.
+
+    ClaudeSDKClient must be connected, used and disconnected from the same task,
+    so each pooled client runs in its own worker task and requests exchange
+    prompts and messages with it through queues. The per-request response queue
+    is bounded, which lets the worker read ahead of the response writer without
+    buffering a whole response.
+    """
+
+    def __init__(self, options: ClaudeAgentOptions):
+        self.last_used = time.monotonic()
+        self._requests: asyncio.Queue = asyncio.Queue()
+        self._responses: asyncio.Queue | None = None
+        self._task = asyncio.create_task(self._run(options))
+
+    @property
+    def alive(self) -> bool:
+        return not self._task.done()
+
+    async def _run(self, options: ClaudeAgentOptions) -> None:
+        responses = None
+        try:
+            async with ClaudeSDKClient(options=options) as client:
+                while (request := await self._requests.get()) is not None:
+                    prompt, responses = request
+                    await client.query(prompt)
+                    async for msg in client.receive_response():
+                        await responses.put(msg)
+                    await responses.put(_END_OF_RESPONSE)
+                    responses = None
+        except Exception as e:
+            # Hand the error to the request waiting on this client, if any
+            if responses is None and not self._requests.empty():
+                request = self._requests.get_nowait()
+                responses = request[1] if request else None
+            if responses is not None:
+                await responses.put(e)
+            else:
+                logger.warning("Pooled Claude client closed with error: %s", e)
+
+    async def receive_response(self, prompt: str) -> AsyncIterator[Any]:
+        """Send a prompt to the worker and yield the messages it streams back."""
+        responses: asyncio.Queue = asyncio.Queue(maxsize=_RESPONSE_BUFFER_SIZE)
+        self._responses = responses
+        self._requests.put_nowait((prompt, responses))
+        try:
+            while (msg := await responses.get()) is not _END_OF_RESPONSE:
+                if isinstance(msg, Exception):
+                    raise msg
+                yield msg
+        finally:
+            self._responses = None
+
+    def has_buffered_messages(self) -> bool:
+        """Whether messages for the current request are already waiting."""
+        return self._responses is not None and not self._responses.empty()
+
+    def close(self) -> None:
+        """Disconnect once the worker is idle."""
+        if self.alive:
+            self._requests.put_nowait(None)
+
+    def abort(self) -> None:
+        """Disconnect immediately, abandoning any in-flight response."""
+        self._task.cancel()
+
+
+async def _clean_client_pool() -> None:
+    """Periodically close pooled clients that have been idle too long."""
+    while True:
+        await asyncio.sleep(_CLIENT_POOL_CLEAN_INTERVAL_SECONDS)
+        cutoff = time.monotonic() - _CLIENT_IDLE_TIMEOUT_SECONDS
+        async with _client_pool_lock:
+            for key in [k for k, c in _CLIENT_POOL.items() if c.last_used < cutoff]:
+                _CLIENT_POOL.pop(key).close()
+
+
+async def _checkout_client(
+    key: tuple, options: ClaudeAgentOptions
+) -> tuple[_PooledClient, bool]:
+    """Take the idle client for this session out of the pool, or start a new one.
+
+    Returns the client and whether it was reused from the pool.
+    """
+    global _client_pool_janitor
+    async with _client_pool_lock:
+        if _client_pool_janitor is None or _client_pool_janitor.done():
+            _client_pool_janitor = asyncio.create_task(_clean_client_pool())
+        # A fresh session (no resume ID) must never pick up another conversation
+        pooled = _CLIENT_POOL.pop(key, None) if key[0] else None
+    if pooled is None or not pooled.alive:
+        return _PooledClient(options), False
+    return pooled, True
+
+
+async def _return_client(key: tuple, pooled: _PooledClient) -> None:
+    """Park a client in the pool, evicting the least recently used when full."""
+    async with _client_pool_lock:
+        previous = _CLIENT_POOL.pop(key, None)
+        if previous is not None:
+            previous.close()
+        pooled.last_used = time.monotonic()
+        _CLIENT_POOL[key] = pooled
+        while len(_CLIENT_POOL) > _CLIENT_POOL_MAX_SIZE:
+            oldest = min(_CLIENT_POOL, key=lambda k: _CLIENT_POOL[k].last_used)
+            _CLIENT_POOL.pop(oldest).close()
+
+
+def _join_text(parts: list[str]) -> dict:
+    """Merge buffered text into a single event and empty the buffer."""
+    event = {"data": "".join(parts)}
+    parts.clear()
+    return event
+
+
+async def _process_messages(
+    prompt: str,
+    resume_id: str | None,
+    gateway_url: str | None,
+    access_token: str | None,
+    state: _StreamState,
+) -> AsyncIterator[dict]:
+    """Run the agent on a pooled client and yield response events."""
+    options = _build_options(resume_id, gateway_url, access_token)
+    pooled, reused = await _checkout_client((resume_id, gateway_url, access_token), options)
+    text_parts: list[str] = []
+    while True:
+        received = False
+        try:
+            async for msg in pooled.receive_response(prompt):
+                received = True
+                handler = _MSG_HANDLERS.get(type(msg))
+                if not handler:
+                    continue
+                for event in handler(msg, state):
+                    if "data" in event:
+                        text_parts.append(event["data"])
+                        continue
+                    if text_parts:
+                        yield _join_text(text_parts)
+                    yield event
+                # Hold text back only while more messages are already waiting, so
+                # a backed-up consumer gets one larger chunk and nothing is delayed
+                if text_parts and (
+                    sum(map(len, text_parts)) >= _TEXT_COALESCE_CHARS
+                    or not pooled.has_buffered_messages()
+                ):
+                    yield _join_text(text_parts)
+            if text_parts:
+                yield _join_text(text_parts)
+            break
+        except Exception:
+            pooled.abort()
+            if not reused or received:
+                raise
+            # The pooled claude-code process may have died while idle; resume the
+            # session in a new one before giving up on the conversation
+            logger.warning("Pooled client for session %s failed, respawning", resume_id)
+            pooled, reused = _PooledClient(options), False
+        except BaseException:
+            pooled.abort()
+            raise
+    # Only park clients for callers that resume sessions; anything else would
+    # leave an idle claude-code process waiting for a session ID nobody sends
+    if not (resume_id and state.claude_session_id):
+        pooled.close()
+        return
+    try:
+        await _return_client((state.claude_session_id, gateway_url, access_token), pooled)
+    except BaseException:
+        pooled.abort()
+        raise
+
+
+@app.entrypoint
+async def main(payload, context: RequestContext):
+    """
+    Entrypoint for the Claude Agent SDK pattern.
+    Uses ClaudeSDKClient for streaming with Code Interpreter and Gateway tools.
+    User identity is extracted securely from the validated JWT token.
+    """
+    prompt = payload["prompt"]
+    runtime_session_id = payload.get("runtimeSessionId", "")
+    code_int_session_id = payload.get("code_int_session_id", "")
+    claude_session_id = payload.get("claude_session_id")
+
+    # Extract user ID securely from validated JWT token
+    user_id = extract_user_id_from_context(context)
+    logger.info("[AGENT] User: %s, Session: %s", user_id, runtime_session_id)
+
+    # Get Gateway URL and access token (cached per container)
+    gateway_url, access_token = await _get_gateway_config()
 
-    async def _process_messages(options: ClaudeAgentOptions):
-        """Run the agent and yield response events."""
-        async with ClaudeSDKClient(options=options) as client:
-            await client.query(prompt)
-            async for msg in client.receive_response():
-                if isinstance(msg, SystemMessage):
-                    if msg.subtype == "init":
-                        logger.info("Claude session init: %s", msg.data.get("session_id"))
-                elif isinstance(msg, AssistantMessage):
-                    for block in msg.content:
-                        if isinstance(block, ToolUseBlock):
-                            logger.info("TOOL USE: %s", block.name)
-                            yield {
-                                "current_tool_use": {
-                                    "name": block.name,
-                                    "input": block.input,
-                                    "toolUseId": f"tool-{block.id}" if hasattr(block, "id") else f"tool-{hash(block.name)}",
-                                }
-                            }
-                        elif isinstance(block, TextBlock):
-                            logger.info("Agent response: %s", block.text)
-                            agent_responses.append(block.text)
-                            yield {"data": block.text}
-                elif isinstance(msg, UserMessage):
-                    for block in msg.content:
-                        if isinstance(block, ToolResultBlock):
-                            if block.content and len(block.content) > 0:
-                                if isinstance(block.content[0], dict):
-                                    text_content = block.content[0].get("text", "")
-                                    try:
-                                        result_data = json.loads(text_content)
-                                        if isinstance(result_data, dict):
-                                            extracted = result_data.get("code_int_session_id", "")
-                                            if extracted:
-                                                code_int_session_id = extracted
-                                    except json.JSONDecodeError:
-                                        pass
-                elif isinstance(msg, ResultMessage):
-                    logger.info("ResultMessage received, session_id=%s", msg.session_id)
-                    yield {"claude_session_id": msg.session_id}
+    state = _StreamState(code_int_session_id=code_int_session_id)
 
     try:
-        async for event in _process_messages(_build_options(claude_session_id)):
+        async for event in _process_messages(
+            prompt, claude_session_id, gateway_url, access_token, state
+        ):
             yield event
     except ProcessError:
         if claude_session_id:
             logger.warning("Resume failed for session %s, starting fresh session", claude_session_id)
-            async for event in _process_messages(_build_options(None)):
+            # _build_options is cached, so the fresh-session options are only
+            # built once per container/token rather than on every retry
+            async for event in _process_messages(
+                prompt, None, gateway_url, access_token, state
+            ):
                 yield event
         else:
             raise
@@ -11,20 +11,18 @@ ClaudeAgentOptions.
 
 from claude_agent_sdk import AgentDefinition
 
+# Code Interpreter session rules shared by the main agent and subagent prompts
+SESSION_MANAGEMENT_RULES = """CRITICAL SESSION MANAGEMENT:
+1. For the FIRST Code Interpreter call, pass an empty string "" for code_int_session_id
+2. The tool will return a session ID in its response
+3. Use that EXACT returned session ID for ALL subsequent Code Interpreter calls
+4. NEVER make up or generate your own session IDs
+5. Only use "" (first call) or the exact session ID returned by Code Interpreter"""
 
-def get_subagent_definitions(mcp_servers: dict) -> dict[str, AgentDefinition]:
-    """Build subagent definitions for task delegation.
-
-    Args:
-        mcp_servers: Dictionary of MCP server configurations.
-
-    Returns:
-        Dictionary mapping subagent names to their AgentDefinition configurations.
-    """
-    return {
-        "code-analyst": AgentDefinition(
-            description="Analyzes code output, debugs errors, and explains results. Can execute code via Code Interpreter. Use when you have code execution output or errors that need detailed analysis. Pass the output/error text directly in the task prompt.",
-            prompt="""You are a code analysis specialist. You receive code, execution output, and error messages for analysis.
+# Definitions are static, so they are built once at import and shared
+_CODE_ANALYST_DEFINITION = AgentDefinition(
+    description="Analyzes code output, debugs errors, and explains results. Can execute code via Code Interpreter. Use when you have code execution output or errors that need detailed analysis. Pass the output/error text directly in the task prompt.",
+    prompt=f"""You are a code analysis specialist. You receive code, execution output, and error messages for analysis.
 
 When analyzing:
 - Identify root causes of errors
@@ -33,20 +31,26 @@ When analyzing:
 - Use mcp__codeint__execute_code to test fixes if needed
 - Summarize findings concisely
 
-CRITICAL SESSION MANAGEMENT:
-1. For the FIRST Code Interpreter call, pass an empty string "" for code_int_session_id
-2. The tool will return a session ID in its response
-3. Use that EXACT returned session ID for ALL subsequent Code Interpreter calls
-4. NEVER make up or generate your own session IDs
-5. Only use "" (first call) or the exact session ID returned by Code Interpreter""",
-            tools=[
-                "mcp__codeint__execute_code",
-                "mcp__codeint__execute_command",
-                "mcp__gateway__*",
-                "Read",
-                "Grep",
-                "Glob",
-            ],
-            model="sonnet",
-        ),
-    }
+{SESSION_MANAGEMENT_RULES}""",
+    tools=[
+        "mcp__codeint__execute_code",
+        "mcp__codeint__execute_command",
+        "mcp__gateway__*",
+        "Read",
+        "Grep",
+        "Glob",
+    ],
+    model="sonnet",
+)
+
+
+def get_subagent_definitions(mcp_servers: dict) -> dict[str, AgentDefinition]:
+    """Return subagent definitions for task delegation.
+
+    Args:
+        mcp_servers: Dictionary of MCP server configurations.
+
+    Returns:
+        Dictionary mapping subagent names to their AgentDefinition configurations.
+    """
+    return {"code-analyst": _CODE_ANALYST_DEFINITION}
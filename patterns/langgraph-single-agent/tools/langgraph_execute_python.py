@@ -15,6 +15,7 @@ class LangGraphCodeInterpreterTools:
             region: AWS region for code interpreter
         """
         self.core_tools = CodeInterpreterTools(region)
+        self.execute_python_securely = tool(self._make_execute_python(self.core_tools))
 
     def cleanup(self):
         """
@@ -25,15 +26,29 @@ class LangGraphCodeInterpreterTools:
         """
         self.core_tools.cleanup()
 
-    @tool
-    def execute_python_securely(self, code: str) -> str:
+    @staticmethod
+    def _make_execute_python(core_tools: CodeInterpreterTools):
         """
-        Execute Python code in a secure AgentCore CodeInterpreter sandbox.
+        Build the execute tool as a closure over the core tools.
 
-        Args:
-            code: Python code to execute
+        Decorating the method directly would leave `self` in the tool's
+        inferred argument schema; binding through a closure keeps the schema
+        to the single `code` argument the model should fill in.
 
-        Returns:
-            JSON string with execution result
+        Args:
+            core_tools: Shared Code Interpreter tools instance
         """
-        return self.core_tools.execute_python_securely(code)
+
+        def execute_python_securely(code: str) -> str:
+            """
+            Execute Python code in a secure AgentCore CodeInterpreter sandbox.
+
+            Args:
+                code: Python code to execute
+
+            Returns:
+                JSON string with execution result
+            """
+            return core_tools.execute_python_securely(code)
+
+        return execute_python_securely
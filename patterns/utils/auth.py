@@ -139,6 +139,25 @@ def get_gateway_access_token() -> str:
     Returns:
         str: A valid OAuth2 access token for Gateway authentication.
 
+    Raises:
+        KeyError: If the STACK_NAME environment variable is not set.
+        Exception: If the token request fails or the response is invalid.
+    """
+    access_token, _ = get_gateway_access_token_with_expiry()
+    return access_token
+
+
+def get_gateway_access_token_with_expiry() -> tuple[str, int]:
+    """
+    Get an OAuth2 access token and its lifetime using the client credentials flow.
+
+    Same as get_gateway_access_token(), but also returns the token lifetime
+    reported by Cognito so callers can cache the token until it expires.
+
+    Returns:
+        tuple[str, int]: The access token and its lifetime in seconds
+            (the 'expires_in' field of the token response).
+
     Raises:
         KeyError: If the STACK_NAME environment variable is not set.
         Exception: If the token request fails or the response is invalid.
@@ -195,5 +214,8 @@ def get_gateway_access_token() -> str:
         logger.error("No access_token in response: %s", token_data)
         raise Exception("No access_token in Cognito response")
 
+    # Cognito always reports expires_in; fall back to its one-hour default
+    expires_in = int(token_data.get("expires_in", 3600))
+
     logger.info("Successfully got access token: %s...", access_token[:20])
-    return access_token
+    return access_token, expires_in
@@ -0,0 +1,402 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""
+Unit tests for the pooled ClaudeSDKClient in the Claude Agent SDK pattern.
+
+The pattern's runtime dependencies (claude-agent-sdk, bedrock-agentcore) are
+only installed in its container image, so they are replaced with small stubs
+and the claude-code process is simulated by a fake ClaudeSDKClient.
+"""
+
+import asyncio
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+PATTERN_DIR = Path(__file__).resolve().parents[2] / "patterns" / "claude-agent-sdk"
+
+
+class _Record:
+    """Stand-in for SDK message, block and options dataclasses."""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class ProcessError(Exception):
+    pass
+
+
+class FakeClaudeSDKClient:
+    """Simulates one claude-code process and records how it is used."""
+
+    instances: list["FakeClaudeSDKClient"] = []
+    fail_connect_for: set = set()
+    # Messages to stream instead of the default echo; an asyncio.Event pauses
+    # the stream until it is set
+    script: list | None = None
+
+    def __init__(self, options):
+        self.options = options
+        self.session_id = options.resume or f"session-{len(self.instances) + 1}"
+        self.prompts: list[str] = []
+        self.dead = False
+        self.disconnected = False
+        self.instances.append(self)
+
+    async def __aenter__(self):
+        if self.options.resume in self.fail_connect_for:
+            raise ProcessError(f"cannot resume {self.options.resume}")
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.disconnected = True
+
+    async def query(self, prompt):
+        if self.dead:
+            raise ConnectionError("claude-code process exited")
+        self.prompts.append(prompt)
+
+    async def receive_response(self):
+        if self.script is not None:
+            for item in self.script:
+                if isinstance(item, asyncio.Event):
+                    await item.wait()
+                else:
+                    yield item
+            return
+        sdk = sys.modules["claude_agent_sdk"]
+        prompt = self.prompts[-1]
+        yield sdk.AssistantMessage(content=[sdk.TextBlock(text=f"echo {prompt}")])
+        yield sdk.ResultMessage(session_id=self.session_id)
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    """Import a fresh copy of the pattern's agent module against stubs."""
+    sdk = types.ModuleType("claude_agent_sdk")
+    for name in (
+        "AssistantMessage",
+        "UserMessage",
+        "ResultMessage",
+        "SystemMessage",
+        "ClaudeAgentOptions",
+        "TextBlock",
+        "ToolUseBlock",
+        "ToolResultBlock",
+        "AgentDefinition",
+    ):
+        setattr(sdk, name, type(name, (_Record,), {}))
+    sdk.ProcessError = ProcessError
+    FakeClaudeSDKClient.instances = []
+    FakeClaudeSDKClient.fail_connect_for = set()
+    FakeClaudeSDKClient.script = None
+    sdk.ClaudeSDKClient = FakeClaudeSDKClient
+
+    runtime = types.ModuleType("bedrock_agentcore.runtime")
+    runtime.BedrockAgentCoreApp = lambda: types.SimpleNamespace(entrypoint=lambda f: f)
+    runtime.RequestContext = object
+    code_int_server = types.ModuleType("code_int_mcp.server")
+    code_int_server.code_int_mcp_server = object()
+    auth = types.ModuleType("utils.auth")
+    auth.extract_user_id_from_context = lambda context: "user-1"
+    auth.get_gateway_access_token_with_expiry = lambda: ("token", 3600)
+    ssm = types.ModuleType("utils.ssm")
+    ssm.get_ssm_parameter = lambda name: "https://gateway.example.com"
+
+    for name, module in {
+        "claude_agent_sdk": sdk,
+        "bedrock_agentcore": types.ModuleType("bedrock_agentcore"),
+        "bedrock_agentcore.runtime": runtime,
+        "code_int_mcp.server": code_int_server,
+        "utils.auth": auth,
+        "utils.ssm": ssm,
+    }.items():
+        monkeypatch.setitem(sys.modules, name, module)
+    for name in ("agent", "agents", "agents.subagents"):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    monkeypatch.syspath_prepend(str(PATTERN_DIR))
+    monkeypatch.delenv("STACK_NAME", raising=False)
+
+    import agent as agent_module
+
+    return agent_module
+
+
+async def _run_turn(agent, prompt, resume_id=None):
+    state = agent._StreamState()
+    events = [
+        event
+        async for event in agent._process_messages(prompt, resume_id, None, None, state)
+    ]
+    return events, state
+
+
+async def _settle():
+    """Let pooled worker tasks run until they are idle or finished."""
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.unit
+def test_resumed_turns_reuse_pooled_client(agent):
+    async def scenario():
+        events, state = await _run_turn(agent, "first")
+        assert events == [{"data": "echo first"}, {"claude_session_id": "session-1"}]
+        await _settle()
+        assert FakeClaudeSDKClient.instances[0].disconnected
+
+        # The first resumed turn spawns and parks; the next one reuses it
+        for prompt in ("second", "third"):
+            events, _ = await _run_turn(agent, prompt, state.claude_session_id)
+            assert events == [
+                {"data": f"echo {prompt}"},
+                {"claude_session_id": "session-1"},
+            ]
+
+        assert len(FakeClaudeSDKClient.instances) == 2
+        assert FakeClaudeSDKClient.instances[1].prompts == ["second", "third"]
+        assert list(agent._CLIENT_POOL) == [("session-1", None, None)]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_frontend_payload_does_not_park_clients(agent):
+    async def scenario():
+        # The frontend sends only prompt and runtimeSessionId
+        for prompt in ("one", "two", "three"):
+            payload = {"prompt": prompt, "runtimeSessionId": "runtime-1"}
+            events = [event async for event in agent.main(payload, context=None)]
+            assert events[0] == {"data": f"echo {prompt}"}
+        await _settle()
+
+        assert len(FakeClaudeSDKClient.instances) == 3
+        assert all(client.disconnected for client in FakeClaudeSDKClient.instances)
+        assert agent._CLIENT_POOL == {}
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_cancelled_return_aborts_client(agent, monkeypatch):
+    async def cancelled_return(key, pooled):
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(agent, "_return_client", cancelled_return)
+
+    async def scenario():
+        with pytest.raises(asyncio.CancelledError):
+            await _run_turn(agent, "hello", "session-1")
+        await _settle()
+
+        assert FakeClaudeSDKClient.instances[0].disconnected
+        assert agent._CLIENT_POOL == {}
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_connect_error_is_raised_to_caller(agent):
+    FakeClaudeSDKClient.fail_connect_for = {"missing-session"}
+
+    async def scenario():
+        with pytest.raises(ProcessError):
+            await _run_turn(agent, "hello", "missing-session")
+        assert agent._CLIENT_POOL == {}
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_entrypoint_starts_fresh_session_when_resume_fails(agent):
+    FakeClaudeSDKClient.fail_connect_for = {"missing-session"}
+
+    async def scenario():
+        payload = {"prompt": "hello", "claude_session_id": "missing-session"}
+        events = [event async for event in agent.main(payload, context=None)]
+        assert events == [{"data": "echo hello"}, {"claude_session_id": "session-2"}]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_early_aclose_aborts_client(agent):
+    async def scenario():
+        stream = agent._process_messages(
+            "hello", None, None, None, agent._StreamState()
+        )
+        assert await stream.__anext__() == {"data": "echo hello"}
+        await stream.aclose()
+        await _settle()
+
+        assert FakeClaudeSDKClient.instances[0].disconnected
+        assert agent._CLIENT_POOL == {}
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_pool_evicts_least_recently_used(agent, monkeypatch):
+    monkeypatch.setattr(agent, "_CLIENT_POOL_MAX_SIZE", 2)
+
+    async def scenario():
+        for session_id in ("session-a", "session-b", "session-c"):
+            await _run_turn(agent, "hello", session_id)
+        await _settle()
+
+        first, second, third = FakeClaudeSDKClient.instances
+        assert first.disconnected
+        assert not second.disconnected and not third.disconnected
+        assert list(agent._CLIENT_POOL) == [
+            ("session-b", None, None),
+            ("session-c", None, None),
+        ]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_dead_pooled_client_is_respawned_with_resume(agent):
+    async def scenario():
+        await _run_turn(agent, "first", "session-1")
+        FakeClaudeSDKClient.instances[0].dead = True
+
+        events, _ = await _run_turn(agent, "second", "session-1")
+
+        assert events == [{"data": "echo second"}, {"claude_session_id": "session-1"}]
+        respawned = FakeClaudeSDKClient.instances[1]
+        assert respawned.options.resume == "session-1"
+        assert agent._CLIENT_POOL[("session-1", None, None)] is not None
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_handler_table_resolves_subclasses_and_memoizes_unknown_types(agent):
+    sdk = sys.modules["claude_agent_sdk"]
+    init_message = type("InitSystemMessage", (sdk.SystemMessage,), {})
+
+    assert agent._MSG_HANDLERS.get(init_message) is agent._handle_system_message
+    assert agent._MSG_HANDLERS.get(int) is None
+
+    # Resolutions are memoized without touching the declared handlers
+    assert agent._MSG_HANDLERS._resolved[init_message] is agent._handle_system_message
+    assert agent._MSG_HANDLERS._resolved[int] is None
+    assert init_message not in agent._MSG_HANDLERS.handlers
+    assert int not in agent._MSG_HANDLERS.handlers
+
+
+def _text(sdk, *texts):
+    return sdk.AssistantMessage(content=[sdk.TextBlock(text=text) for text in texts])
+
+
+def _tool_use(sdk):
+    block = sdk.ToolUseBlock(id="t1", name="execute_code", input={})
+    return sdk.AssistantMessage(content=[block])
+
+
+TOOL_EVENT = {
+    "current_tool_use": {"name": "execute_code", "input": {}, "toolUseId": "tool-t1"}
+}
+
+
+@pytest.mark.unit
+def test_queued_text_is_merged_before_tool_event(agent):
+    sdk = sys.modules["claude_agent_sdk"]
+    FakeClaudeSDKClient.script = [
+        _text(sdk, "a", "b"),
+        _text(sdk, "c"),
+        _tool_use(sdk),
+        _text(sdk, "d"),
+        sdk.ResultMessage(session_id="session-1"),
+    ]
+
+    async def scenario():
+        events, _ = await _run_turn(agent, "hello")
+        assert events == [
+            {"data": "abc"},
+            TOOL_EVENT,
+            {"data": "d"},
+            {"claude_session_id": "session-1"},
+        ]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_text_is_flushed_when_nothing_is_queued(agent):
+    sdk = sys.modules["claude_agent_sdk"]
+    gate = asyncio.Event()
+    FakeClaudeSDKClient.script = [
+        _text(sdk, "hi"),
+        gate,
+        sdk.ResultMessage(session_id="session-1"),
+    ]
+
+    async def scenario():
+        stream = agent._process_messages(
+            "hello", None, None, None, agent._StreamState()
+        )
+        # The rest of the response is still pending, so the text must not wait
+        assert await asyncio.wait_for(stream.__anext__(), timeout=1) == {"data": "hi"}
+        gate.set()
+        assert [event async for event in stream] == [{"claude_session_id": "session-1"}]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_merged_text_respects_coalesce_limit(agent, monkeypatch):
+    monkeypatch.setattr(agent, "_TEXT_COALESCE_CHARS", 4)
+    sdk = sys.modules["claude_agent_sdk"]
+    FakeClaudeSDKClient.script = [
+        _text(sdk, "aa"),
+        _text(sdk, "bb"),
+        _text(sdk, "cc"),
+        _tool_use(sdk),
+        sdk.ResultMessage(session_id="session-1"),
+    ]
+
+    async def scenario():
+        events, _ = await _run_turn(agent, "hello")
+        assert events == [
+            {"data": "aabb"},
+            {"data": "cc"},
+            TOOL_EVENT,
+            {"claude_session_id": "session-1"},
+        ]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.unit
+def test_gateway_config_only_uses_threads_on_cache_miss(agent, monkeypatch):
+    monkeypatch.setenv("STACK_NAME", "stack")
+    threaded = []
+    to_thread = asyncio.to_thread
+
+    async def recording_to_thread(func, *args):
+        threaded.append(func.__name__)
+        return await to_thread(func, *args)
+
+    monkeypatch.setattr(agent.asyncio, "to_thread", recording_to_thread)
+    agent._get_gateway_url.cache_clear()
+
+    async def scenario():
+        expected = ("https://gateway.example.com", "token")
+        assert await agent._get_gateway_config() == expected
+        assert sorted(threaded) == ["_get_gateway_access_token", "_get_gateway_url"]
+
+        threaded.clear()
+        assert await agent._get_gateway_config() == expected
+        assert threaded == []
+
+        # An expiring token is refreshed on its own; the URL stays cached
+        agent._gateway_token = ("token", 0.0)
+        assert await agent._get_gateway_config() == expected
+        assert threaded == ["_get_gateway_access_token"]
+
+    asyncio.run(scenario())